@@ -1,6 +1,7 @@
 from .base import data, geodat
 from ._version import __version__
 from .io import load_hdf5
+from .io_zarr import load_zarr
 
 # Shortcut
 load = load_hdf5
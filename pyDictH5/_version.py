@@ -1,2 +1,2 @@
 __package__ = 'pyDictH5'
-__version__ = '0.2.3'
+__version__ = '0.3.0'
@@ -35,16 +35,23 @@ However, only dict entries are stored:
 
     >>> d_copy['time2']
 """
+import h5py
 import numpy as np
 import numpy.testing as nptest
 from copy import deepcopy
 try:
     # PY 3
     from . import io
+    from . import io_zarr
 except ImportError:
     # PY 2
     import io
+    import io_zarr
 import six
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
 
 
 debug_level = 0
@@ -52,6 +59,122 @@ arrayEQ_tols = dict(rtol=1e-3, atol=1e-6)
 
 
 _RaiseKeyError = object()
+_NotFound = object()
+
+# `geodat.llrange` uses a numba kernel (if numba is installed) for
+# arrays with at least this many elements. Compiling the kernel takes
+# a good fraction of a second, so it only pays off for large arrays.
+numba_min_size = 1000000
+# `_box_mask` compiled with numba (see `_get_box_mask`).
+_box_mask_jit = None
+
+
+def _box_mask(lon, lat, lo0, lo1, la0, la1):
+    """Compute the lon/lat box mask of 1-D arrays in a single
+    (multi-threaded) pass (see `geodat.llrange`).
+
+    This is only called once it is compiled by `_get_box_mask`.
+    """
+    out = np.empty(lon.shape[0], np.bool_)
+    for i in numba.prange(lon.shape[0]):
+        out[i] = ((lo0 < lon[i]) and (lon[i] < lo1) and
+                  (la0 < lat[i]) and (lat[i] < la1))
+    return out
+
+
+def _get_box_mask():
+    """Return `_box_mask` compiled with numba, or None if numba is not
+    installed.
+
+    numba is imported on first use, rather than with this module,
+    because importing it is slow.
+    """
+    global _box_mask_jit, numba
+    if _box_mask_jit is None:
+        try:
+            import numba
+        except ImportError:
+            _box_mask_jit = False
+        else:
+            _box_mask_jit = numba.njit(parallel=True, cache=True)(_box_mask)
+    return _box_mask_jit or None
+
+
+def _numba_dtype(dtype):
+    """Whether `_box_mask` supports arrays of `dtype` (numba does not
+    support float16)."""
+    return dtype.kind in 'iu' or dtype in (np.float32, np.float64)
+
+
+# A cache of the attribute names of each data class (see
+# `_reserved_names`).
+_reserved_cache = {}
+
+
+def _reserved_names(cls):
+    """Return a frozenset of the attribute names of `cls`.
+
+    Keys that match these names are forbidden. Computing `dir` is slow,
+    so the result is cached for each class.
+    """
+    try:
+        return _reserved_cache[cls]
+    except KeyError:
+        names = _reserved_cache[cls] = frozenset(dir(cls))
+        return names
+
+
+def _read_lazy(val):
+    """Return `val`, with a lazily-loaded `h5py.Dataset` (see
+    `load_hdf5(..., lazy=True)`) read into memory."""
+    if isinstance(val, h5py.Dataset):
+        return val[()]
+    return val
+
+
+def _h5py_can_index(indx):
+    """Whether h5py supports indexing a dataset with `indx`."""
+    if isinstance(indx, tuple):
+        return all(_h5py_can_index(ind) for ind in indx)
+    if isinstance(indx, slice):
+        # h5py does not support negative steps.
+        return indx.step is None or indx.step > 0
+    if isinstance(indx, np.ndarray) and indx.dtype.kind in 'iu':
+        # Nor index arrays that are not increasing.
+        return not (indx.ndim != 1 or (indx.size > 0 and indx[0] < 0) or
+                    (np.diff(indx) <= 0).any())
+    return True
+
+
+def _index_dataset(dat, indx):
+    """Index the `h5py.Dataset` `dat` with `indx`.
+
+    Only the selected data is read from the file, except for indices
+    that h5py does not support (e.g., index arrays that are not
+    increasing, or slices with a negative step), for which the whole
+    dataset is read and then indexed.
+    """
+    if isinstance(indx, list):
+        indx = np.asarray(indx)
+        if indx.size == 0:
+            indx = indx.astype(np.intp)
+    if not _h5py_can_index(indx):
+        return dat[()][indx]
+    return dat[indx]
+
+
+# The `append` methods that only call `extend` (see `_can_extend`).
+_extend_appends = set()
+
+
+def _can_extend(dat):
+    """Whether `dat` can be joined with others using `dat.extend`,
+    rather than calling `dat.append` for each of them.
+
+    This is only the case if the class of `dat` does not override
+    `append` (which subclasses may do to join data differently).
+    """
+    return six.get_unbound_function(type(dat).append) in _extend_appends
 
 
 class indexer(object):
@@ -63,58 +186,89 @@ class indexer(object):
         return self.parent._subset(indx)
 
 
-def _equiv_dict(d1, d2):
-    if set(d2.keys()) == set(d1.keys()):
-        retval = True
-        for ky in d1:
+def _equiv_value(v1, v2):
+    """Test whether two (non-dict) data items are equivalent."""
+    v1 = _read_lazy(v1)
+    v2 = _read_lazy(v2)
+    if isinstance(v1, np.ndarray):
+        if type(v1) is not type(v2) or v1.shape != v2.shape:  # nopep8
+            return False
+        if v1 is v2:
+            return True
+        if np.issubdtype(v1.dtype, np.inexact):
+            # With zero tolerances this is an exact comparison.
+            return bool(np.allclose(v1, v2, equal_nan=True, **arrayEQ_tols))
+        if v1.dtype.kind in 'OmM':
+            # Object items may not compare to a single bool, and NaT
+            # does not equal itself.
             try:
-                if isinstance(d1[ky], np.ndarray):
-                    assert type(d1[ky]) is type(d2[ky])  # nopep8
-                    assert d1[ky].shape == d2[ky].shape
-                    if (not np.issubdtype(d1[ky].dtype, np.inexact)) or \
-                       arrayEQ_tols == dict(rtol=0, atol=0):
-                        nptest.assert_equal(d1[ky], d2[ky])
-                    else:
-                        assert np.allclose(d1[ky], d2[ky],
-                                           equal_nan=True, **arrayEQ_tols)
-                elif isinstance(d1[ky], dict):
-                    assert _equiv_dict(d1[ky], d2[ky])
-                else:
-                    assert d1[ky] == d2[ky]
+                nptest.assert_equal(v1, v2)
             except AssertionError:
-                retval = False
-                if debug_level > 0:
-                    if isinstance(d1[ky], np.ndarray):
-                        if d1[ky].shape != d2[ky].shape:
-                            print('The shapes of the arrays do not match. '
-                                  '({}, vs. {}).'.format(d1[ky].shape,
-                                                         d2[ky].shape))
-                        else:
-                            frac = np.float((~np.isclose(
-                                d1[ky], d2[ky], equal_nan=True,
-                                **arrayEQ_tols)).sum()) / d1[ky].size
-                            print('{:0.2f}% of the values in {} do not match.'
-                                  .format(frac * 100, ky))
-                        try:
-                            assert np.allclose(d1[ky], d2[ky],
-                                               rtol=1e-3, equal_nan=True)
-                            print(' ... but they are close.')
-                        except:
-                            pass
-                    else:
-                        print('The values in {} do not match.'
-                              .format(ky))
-                else:
+                return False
+            return True
+        return bool(np.array_equal(v1, v2))
+    return bool(v1 == v2)
+
+
+def _print_diff(ky, v1, v2):
+    v1 = _read_lazy(v1)
+    v2 = _read_lazy(v2)
+    if isinstance(v1, np.ndarray):
+        if not isinstance(v2, np.ndarray) or v1.shape != v2.shape:
+            print('The shapes of the arrays do not match. '
+                  '({}, vs. {}).'.format(v1.shape,
+                                         np.shape(v2)))
+        else:
+            frac = float((~np.isclose(
+                v1, v2, equal_nan=True,
+                **arrayEQ_tols)).sum()) / v1.size
+            print('{:0.2f}% of the values in {} do not match.'
+                  .format(frac * 100, ky))
+        try:
+            assert np.allclose(v1, v2,
+                               rtol=1e-3, equal_nan=True)
+            print(' ... but they are close.')
+        except:
+            pass
+    else:
+        print('The values in {} do not match.'
+              .format(ky))
+
+
+def _equiv_dict(d1, d2):
+    """Test whether two dicts (and the dicts within them) are
+    equivalent.
+
+    The nested dicts are compared using a stack, rather than by
+    recursion. If `debug_level` is greater than 0, all of the
+    differences are printed; otherwise this returns False at the first
+    difference.
+    """
+    retval = True
+    stack = [(d1, d2, '')]
+    while stack:
+        d1, d2, prefix = stack.pop()
+        if six.viewkeys(d1) != six.viewkeys(d2):
+            if debug_level <= 0:
+                return False
+            retval = False
+            dif1 = set(d1.keys()) - set(d2.keys())
+            dif2 = set(d2.keys()) - set(d1.keys())
+            print("The list of items are not the same.\n"
+                  "Entries in 1 that are not in 2: {}\n"
+                  "Entries in 2 that are not in 1: {}".format(list(dif1),
+                                                              list(dif2)))
+            continue
+        for ky, v1 in d1.items():
+            v2 = dict.__getitem__(d2, ky)
+            if isinstance(v1, dict):
+                stack.append((v1, v2, prefix + ky + '.'))
+            elif not _equiv_value(v1, v2):
+                if debug_level <= 0:
                     return False
-        return retval
-    if debug_level > 0:
-        dif1 = set(d1.keys()) - set(d2.keys())
-        dif2 = set(d2.keys()) - set(d1.keys())
-        print("The list of items are not the same.\n"
-              "Entries in 1 that are not in 2: {}\n"
-              "Entries in 2 that are not in 1: {}".format(list(dif1),
-                                                          list(dif2)))
-    return False
+                retval = False
+                _print_diff(prefix + ky, v1, v2)
+    return retval
 
 
 class data(dict):
@@ -146,36 +300,46 @@ class data(dict):
         return indexer(self)
 
     def _subset(self, indx, raise_on_empty_array=False, copy=[]):
+        if indx.__class__ is list and len(indx) > 0:
+            # Convert the list to an array once, rather than once for
+            # every array (and sub-object) that is indexed. (An empty
+            # list would become a float array, which is not a valid
+            # index.)
+            indx = np.asarray(indx)
         out = self.__class__()
-        for nm in self:
+        for nm, dat in self.items():
             if nm in copy:
-                out[nm] = deepcopy(self[nm])
-            elif isinstance(self[nm], data):
-                out[nm] = self[nm]._subset(
+                val = deepcopy(dat)
+            elif isinstance(dat, data):
+                val = dat._subset(
                     indx,
                     raise_on_empty_array=raise_on_empty_array,
                     copy=copy)
-            elif isinstance(self[nm], np.ndarray):
-                out[nm] = self[nm][indx]
-                if raise_on_empty_array and \
-                   (np.array(out[nm].shape) == 0).any():
+            elif isinstance(dat, (np.ndarray, h5py.Dataset)):
+                if isinstance(dat, np.ndarray):
+                    val = dat[indx]
+                else:
+                    val = _index_dataset(dat, indx)
+                if raise_on_empty_array and 0 in val.shape:
                     raise IndexError("The indexing object yields "
                                      "empty arrays for field '{}'.".format(nm))
             else:
-                out[nm] = self[nm]
+                val = dat
+            # The keys were checked when they were added to self, so
+            # skip data.__setitem__.
+            dict.__setitem__(out, nm, val)
         return out
 
     def __getitem__(self, indx):
-        if not isinstance(indx, six.string_types) or '.' not in indx:
-            return dict.__getitem__(self, indx)
-        else:
-            try:
-                return dict.__getitem__(self, indx)
-            except KeyError:
-                tmp = self
-                for ky in indx.split('.'):
-                    tmp = dict.__getitem__(tmp, ky)
-                return tmp
+        val = dict.get(self, indx, _NotFound)
+        if val is not _NotFound:
+            return val
+        if isinstance(indx, six.string_types) and '.' in indx:
+            tmp = self
+            for ky in indx.split('.'):
+                tmp = dict.__getitem__(tmp, ky)
+            return tmp
+        raise KeyError(indx)
 
     def append(self, other, array_axis=0):
         """
@@ -188,18 +352,38 @@ class data(dict):
 
         Overload this method to implement alternate appending schemes.
         """
+        self.extend([other], array_axis=array_axis)
+
+    def extend(self, others, array_axis=0):
+        """
+        Append a sequence of PyCoDa data objects to this one.
+
+        This is equivalent to calling `append` for each item in
+        `others`, except that each array is concatenated only once. It
+        should therefore be preferred over repeated calls to `append`
+        when joining many data objects.
+        """
+        others = list(others)
         for nm, dat in self.items():
+            dat = _read_lazy(dat)
             if isinstance(dat, np.ndarray):
-                self[nm] = np.concatenate((self[nm],
-                                           other[nm]),
-                                          axis=array_axis)
+                self[nm] = np.concatenate(
+                    [dat] + [_read_lazy(o[nm]) for o in others],
+                    axis=array_axis)
             elif not hasattr(dat, 'append') or isinstance(self, (PropData, list)):
-                assert dat == other[nm], ("Properties in {} do not match.".format(nm))
-            else:
-                if 'array_axis' in dat.append.__code__.co_varnames:
-                    dat.append(other[nm], array_axis=array_axis)
+                for o in others:
+                    assert dat == o[nm], ("Properties in {} do not match.".format(nm))
+            elif isinstance(dat, data) and _can_extend(dat):
+                if 'array_axis' in dat.extend.__code__.co_varnames:
+                    dat.extend([o[nm] for o in others], array_axis=array_axis)
                 else:
-                    dat.append(other[nm])
+                    dat.extend([o[nm] for o in others])
+            else:
+                for o in others:
+                    if 'array_axis' in dat.append.__code__.co_varnames:
+                        dat.append(o[nm], array_axis=array_axis)
+                    else:
+                        dat.append(o[nm])
 
     def pop(self, indx, d=_RaiseKeyError):
         if not isinstance(indx, six.string_types):
@@ -228,17 +412,23 @@ class data(dict):
             tmp = self[grp]
         else:
             tmp = self
-        if indx in dir(tmp):
+        if (indx in _reserved_names(type(tmp)) or
+                indx in getattr(tmp, '__dict__', ())):
             raise KeyError("The attribute '{}' exists: Creating a key that "
                            "matches an attribute name is forbidden.".format(indx))
         dict.__setitem__(tmp, indx, val)
 
     def __contains__(self, key):
-        try:
-            self[key]
+        if dict.__contains__(self, key):
             return True
-        except KeyError:
+        if not isinstance(key, six.string_types) or '.' not in key:
             return False
+        tmp = self
+        for ky in key.split('.'):
+            if not isinstance(tmp, dict) or not dict.__contains__(tmp, ky):
+                return False
+            tmp = dict.__getitem__(tmp, ky)
+        return True
 
     def __repr__(self, ):
         outstr = '{}: Data Object with Keys:\n'.format(self.__class__)
@@ -256,16 +446,21 @@ class data(dict):
               Whether entries starting with '_' should be included in
               the iteration.
         """
-        for ky in self:
-            if not include_hidden and ky.startswith('_'):
-                continue
-            if isinstance(self[ky], data):
-                yield ky
-                for ky2 in self[ky].iter_subgroups():
-                    if not include_hidden and ky2.startswith('_'):
-                        continue
-                    if isinstance(self[ky][ky2], data):
-                        yield '{}.{}'.format(ky, ky2)
+        # Walk the tree depth-first with a stack of (prefix, items)
+        # iterators, rather than recursing. Hidden entries below the
+        # top level are always skipped.
+        stack = [('', iter(dict.items(self)))]
+        while stack:
+            prefix, items = stack[-1]
+            for ky, val in items:
+                if ky.startswith('_') and (prefix or not include_hidden):
+                    continue
+                if isinstance(val, data):
+                    yield prefix + ky
+                    stack.append((prefix + ky + '.', iter(dict.items(val))))
+                    break
+            else:
+                stack.pop()
 
     def iter_data(self, include_hidden=False):
         """Generate the keys for all data items in this data object,
@@ -277,21 +472,57 @@ class data(dict):
               Whether entries starting with '_' should be included in
               the iteration.
         """
-        for ky in self:
-            if not include_hidden and ky.startswith('_'):
-                continue
-            if isinstance(self[ky], data):
-                for ky2 in self[ky].iter_data(include_hidden=include_hidden):
-                    yield '{}.{}'.format(ky, ky2)
+        # Walk the tree depth-first with a stack of (prefix, items)
+        # iterators, rather than recursing.
+        stack = [('', iter(dict.items(self)))]
+        while stack:
+            prefix, items = stack[-1]
+            for ky, val in items:
+                if not include_hidden and ky.startswith('_'):
+                    continue
+                if isinstance(val, data):
+                    stack.append((prefix + ky + '.', iter(dict.items(val))))
+                    break
+                yield prefix + ky
             else:
-                yield ky
+                stack.pop()
+
+    def materialize(self, ):
+        """Read any data that was lazily loaded (see
+        `load_hdf5(..., lazy=True)`) into memory.
+        """
+        for nm, dat in self.items():
+            if isinstance(dat, h5py.Dataset):
+                dict.__setitem__(self, nm, dat[()])
+            elif isinstance(dat, data):
+                dat.materialize()
 
     def __copy__(self, ):
-        """Create a copy of the data object.
+        """Create a shallow copy of the data object.
+
+        Sub-data objects are copied, so that items can be added to or
+        removed from the copy without changing this object, but arrays
+        (and other items) are shared. Use `deepcopy` to also copy
+        those.
         """
-        return deepcopy(self)
+        out = self.__class__()
+        out.__dict__.update(self.__dict__)
+        for nm, dat in dict.items(self):
+            if isinstance(dat, data):
+                dat = dat.__copy__()
+            dict.__setitem__(out, nm, dat)
+        return out
+
+    def copy(self, ):
+        """Create a shallow copy of the data object (see `__copy__`).
+        """
+        return self.__copy__()
 
-    copy = __copy__
+    def deepcopy(self, ):
+        """Create a copy of the data object, including copies of all
+        of its arrays.
+        """
+        return deepcopy(self)
 
     def __eq__(self, other):
         """
@@ -300,7 +531,7 @@ class data(dict):
         return self.__class__ is other.__class__ and _equiv_dict(self, other)
 
     def __setattr__(self, nm, val):
-        if nm.startswith('_') and (nm not in self):
+        if nm.startswith('_') and not dict.__contains__(self, nm):
             # Support for 'temporary variables' that are not added to
             # the dictionary, and therefore not included in I/O
             # operations.
@@ -311,23 +542,45 @@ class data(dict):
     # def __getstate__(self, ):
     #     return self
 
-    def __getattribute__(self, nm):
+    def __getattr__(self, nm):
+        # This is only called when the normal attribute lookup fails,
+        # so methods and other attributes are found at full speed.
         try:
-            return dict.__getattribute__(self, nm)
-        except AttributeError:
-            try:
-                return self[nm]
-            except KeyError:
-                raise AttributeError("'{}' object has no attribute '{}'"
-                                     .format(str(self.__class__).split("'")[-2].split('.')[-1],
-                                             nm))
+            return self[nm]
+        except KeyError:
+            raise AttributeError("'{}' object has no attribute '{}'"
+                                 .format(str(self.__class__).split("'")[-2].split('.')[-1],
+                                         nm))
 
-    def to_hdf5(self, buf, chunks=True, compression='gzip'):
+    def to_hdf5(self, buf, chunks=True, compression='blosc:lz4'):
         """
         Write the data in this object to an hdf5 file.
+
+        By default arrays are compressed with Blosc (LZ4 with
+        bit-shuffling) when the `hdf5plugin` package is installed, and
+        with LZF otherwise. Specify `compression='gzip'` for maximum
+        portability of the file, or `compression=None` to disable
+        compression.
+
+        With the default `chunks` and `compression`, arrays smaller
+        than one chunk (`io.chunk_nbytes`, 1 MiB) are stored
+        contiguously and are not compressed.
         """
         io.hdf5_write(buf, self, chunks=chunks, compression=compression)
 
+    def to_zarr(self, buf, chunks=True, compressor=True):
+        """
+        Write the data in this object to a zarr store.
+
+        This requires the `zarr` package. By default arrays are
+        compressed with Blosc (Zstandard with bit-shuffling); see
+        `io_zarr.zarr_write`.
+        """
+        io_zarr.zarr_write(buf, self, chunks=chunks, compressor=compressor)
+
+
+_extend_appends.add(six.get_unbound_function(data.append))
+
 
 class PropData(data):
 
@@ -341,6 +594,13 @@ class PropData(data):
                                "their properties do not match.")
         return self
 
+    def extend(self, others, array_axis=0):
+        """
+        """
+        for other in others:
+            self.append(other)
+        return self
+
 
 class geodat(data):
     """
@@ -350,12 +610,38 @@ class geodat(data):
     """
 
     def llrange(self, lon=None, lat=None):
-        if lon is not None:
-            inds = (lon[0] < self['lon']) & (self['lon'] < lon[1])
+        if (lon is not None and lat is not None and
+                isinstance(self['lon'], np.ndarray) and
+                isinstance(self['lat'], np.ndarray) and
+                self['lon'].size >= numba_min_size and
+                self['lon'].shape == self['lat'].shape and
+                _numba_dtype(self['lon'].dtype) and
+                _numba_dtype(self['lat'].dtype) and
+                _get_box_mask() is not None):
+            # The kernel works on 1-D arrays, so N-D arrays are
+            # flattened (without a copy, if they are contiguous).
+            inds = _get_box_mask()(self['lon'].ravel(), self['lat'].ravel(),
+                                   lon[0], lon[1], lat[0], lat[1]
+                                   ).reshape(self['lon'].shape)
+        elif ne is not None and lon is not None and lat is not None:
+            # Evaluate the mask in a single (multi-threaded) pass.
+            inds = ne.evaluate('(lo0 < x) & (x < lo1) & (la0 < y) & (y < la1)',
+                               local_dict=dict(x=self['lon'], y=self['lat'],
+                                               lo0=lon[0], lo1=lon[1],
+                                               la0=lat[0], la1=lat[1]))
         else:
-            inds = np.ones(self['lon'].shape, dtype='bool')
-        if lat is not None:
-            inds &= (lat[0] < self['lat']) & (self['lat'] < lat[1])
+            # Combine the comparisons in-place, to avoid temporaries.
+            inds = None
+            for nm, rng in (('lon', lon), ('lat', lat)):
+                if rng is None:
+                    continue
+                if inds is None:
+                    inds = rng[0] < self[nm]
+                else:
+                    inds &= rng[0] < self[nm]
+                inds &= self[nm] < rng[1]
+            if inds is None:
+                inds = np.ones(self['lon'].shape, dtype='bool')
         other_inds = {nm: dat.llrange(lon=lon, lat=lat)
                       for nm, dat in self.items()
                       if isinstance(dat, geodat)}
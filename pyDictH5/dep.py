@@ -1,7 +1,12 @@
-from .base import data
+from .base import (data, _read_lazy, _index_dataset, _can_extend,
+                   _extend_appends)
+import h5py
 import numpy as np
+import six
 
 indx_subset_valid = (slice, np.ndarray, list, int)
+# The index types that __getitem__ treats as a subset (rather than a key).
+_getitem_subset_types = indx_subset_valid + (tuple, )
 
 
 class flat(data):
@@ -50,21 +55,28 @@ class flat(data):
 
         """
         out = self.__class__()
-        for nm, dat in self.iteritems():
+        for nm, dat in self.items():
             if isinstance(dat, np.ndarray):
                 shp = list(dat.shape)
                 shp[0] = npt
                 out[nm] = array_creator(shp, dtype=dat.dtype,)
-            elif hasattr(self, 'empty_like'):
+            elif isinstance(dat, flat):
                 out[nm] = dat.empty_like(npt, array_creator=array_creator)
         return out
 
     def __getitem__(self, indx):
-        if isinstance(indx, indx_subset_valid + (tuple, )):
+        if isinstance(indx, _getitem_subset_types):
             return self.subset(indx)
         else:
             return data.__getitem__(self, indx)
 
+    def __copy__(self, ):
+        out = data.__copy__(self)
+        # The spare room in the append buffers belongs to `self` (see
+        # `_grow`), so it must not be shared.
+        out.__dict__.pop('_buffers', None)
+        return out
+
     def append(self, other):
         """
         Append another PyCoDa data object to this one.  This method
@@ -76,13 +88,76 @@ class flat(data):
 
         Overload this method to implement alternate appending schemes.
         """
-        for nm, dat in self.iteritems():
+        self.extend([other])
+
+    def extend(self, others):
+        """
+        Append a sequence of PyCoDa data objects to this one.
+
+        This is equivalent to calling `append` for each item in
+        `others`, except that each array is grown only once.
+        """
+        others = list(others)
+        for nm, dat in self.items():
+            dat = _read_lazy(dat)
             if isinstance(dat, np.ndarray):
-                self[nm] = np.concatenate((self[nm],
-                                           other[nm]),
-                                          axis=0)
+                self[nm] = self._grow(nm, dat,
+                                      [_read_lazy(o[nm]) for o in others])
+            elif isinstance(dat, data) and _can_extend(dat):
+                dat.extend([o[nm] for o in others])
+            else:
+                for o in others:
+                    dat.append(o[nm])
+
+    def _grow(self, nm, dat, arrays):
+        """
+        Return `dat` with `arrays` appended along axis 0.
+
+        The result is a view into a backing buffer (stored in
+        `self._buffers`) whose capacity grows geometrically, so that
+        repeated appends cost amortized O(1) per appended item rather
+        than a copy of the whole array each time.
+        """
+        arrays = [np.asanyarray(arr) for arr in arrays]
+        npt = dat.shape[0]
+        for arr in arrays:
+            if arr.shape[1:] != dat.shape[1:]:
+                raise ValueError(
+                    "Cannot append an array of shape {} to field '{}' "
+                    "of shape {}.".format(arr.shape, nm, dat.shape))
+        need = npt + sum(arr.shape[0] for arr in arrays)
+        dtype = np.result_type(dat, *arrays)
+        buffers = self.__dict__.setdefault('_buffers', {})
+        buf, view = buffers.get(nm, (None, None))
+        if dat is not view or dtype != buf.dtype or need > buf.shape[0]:
+            # `dat` is not the array that was last returned for this
+            # field (e.g., it was replaced, or sliced), or the buffer
+            # is too small, so allocate a new one. Other arrays may be
+            # views into the old buffer, so it is never written to
+            # again. The first append allocates exactly what is
+            # needed; only repeated appends grow the buffer
+            # geometrically.
+            if dat is view:
+                cap = max(2 * buf.shape[0], need)
             else:
-                dat.append(other[nm])
+                cap = need
+            buf = np.empty((cap, ) + dat.shape[1:], dtype=dtype)
+            # Copy the old and new data straight into the new buffer.
+            view = np.concatenate([dat] + arrays, axis=0, out=buf[:need])
+        else:
+            for arr in arrays:
+                buf[npt:npt + arr.shape[0]] = arr
+                npt += arr.shape[0]
+            view = buf[:npt]
+        buffers[nm] = (buf, view)
+        return view
+
+    def __getstate__(self, ):
+        # The append buffers (see `_grow`) are not part of the data, so
+        # their spare capacity is not pickled (or deep-copied).
+        state = self.__dict__.copy()
+        state.pop('_buffers', None)
+        return state
 
     def subset(self, inds, **kwargs):
         """
@@ -103,19 +178,27 @@ class flat(data):
                 isinstance(inds[1], dict)):
             return self.subset(inds[0], **inds[1])
         out = self.__class__()
-        for nm in self:
-            if isinstance(self[nm], data):
+        for nm, dat in self.items():
+            if isinstance(dat, data):
                 if nm in kwargs:
-                    out[nm] = self[nm][kwargs[nm]]
-                elif isinstance(self[nm], flat):
-                    out[nm] = self[nm][inds]
-                #else:
-                    #print nm, self[nm].__class__
+                    val = dat[kwargs[nm]]
+                elif isinstance(dat, flat):
+                    val = dat[inds]
+                else:
+                    continue
+            elif isinstance(dat, h5py.Dataset):
+                val = _index_dataset(dat, inds)
             else:
-                out[nm] = self[nm][inds]
+                val = dat[inds]
+            # The keys were checked when they were added to self, so
+            # skip data.__setitem__.
+            dict.__setitem__(out, nm, val)
         return out
 
 
+_extend_appends.add(six.get_unbound_function(flat.append))
+
+
 class TimeBased(data):
     """
     This class of data assumes that all data in an instance has the
@@ -152,7 +235,7 @@ class TimeBased(data):
     """
 
     def __getitem__(self, indx):
-        if isinstance(indx, indx_subset_valid + (tuple, )):
+        if isinstance(indx, _getitem_subset_types):
             return self.subset(indx)
         else:
             return dict.__getitem__(self, indx)
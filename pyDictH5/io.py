@@ -9,20 +9,176 @@ except ImportError:
     import base as bm
 import numpy as np
 import six
+import weakref
+try:
+    # Registers the Blosc (and other) compression filters with h5py.
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+# The HDF5 filter id of Blosc.
+_blosc_filter_id = 32001
+# Blosc compressor codes (see the hdf5-blosc filter).
+_blosc_cnames = {'blosclz': 0, 'lz4': 1, 'lz4hc': 2, 'snappy': 3,
+                 'zlib': 4, 'zstd': 5}
+# The target size (in bytes) of dataset chunks.
+chunk_nbytes = 1 << 20
+# The size (in bytes) of the chunk cache used when reading files.
+chunk_cache_nbytes = 16 << 20
+# Plain numeric arrays smaller than this (in bytes) are packed
+# together into a single compound dataset (see `hdf5_write`). This is
+# off (0) by default, because the packed arrays can only be read by
+# pyDictH5 >= 0.3.0 (and are not separate datasets to other hdf5
+# readers). Set this to, e.g., 4096 to enable it.
+pack_nbytes = 0
+# The name of the dataset that holds the packed arrays of a group.
+_packed_name = '__packed__'
+
+
+def _compression_kwargs(compression):
+    """Return the `create_dataset` keyword arguments for the
+    compression scheme `compression`.
+
+    `compression` may be any compression supported by h5py (e.g.,
+    'gzip', 'lzf'), or 'blosc:<cname>' (e.g., 'blosc:lz4'). Blosc is
+    used with bit-shuffling. If the Blosc filter is not available, LZF
+    (which ships with h5py) is used instead.
+    """
+    if compression is None:
+        return {}
+    if not isinstance(compression, six.string_types):
+        # e.g., a gzip level, or a filter id.
+        return dict(compression=compression)
+    if compression.startswith('blosc'):
+        cname = compression.partition(':')[2] or 'lz4'
+        if hdf5plugin is not None:
+            return dict(hdf5plugin.Blosc(cname=cname, clevel=5,
+                                         shuffle=hdf5plugin.Blosc.BITSHUFFLE))
+        if h5py.h5z.filter_avail(_blosc_filter_id):
+            return dict(compression=_blosc_filter_id,
+                        compression_opts=(0, 0, 0, 0, 5, 2,
+                                          _blosc_cnames[cname]))
+        compression = 'lzf'
+    if compression == 'lzf':
+        return dict(compression='lzf', shuffle=True)
+    return dict(compression=compression)
+
+
+# The pickle strings of the classes written to files, which are
+# pickled once per class rather than once per group/dataset.
+_cls_pklstr_cache = weakref.WeakKeyDictionary()
+
+
+def _dumps_cls(cls):
+    try:
+        return _cls_pklstr_cache[cls]
+    except KeyError:
+        # Classes are pickled with protocol 0, because `cls_pklstr_gen`
+        # parses that (text) format when searching for a class.
+        pklstr = _cls_pklstr_cache[cls] = pkl.dumps(cls, protocol=0)
+        return pklstr
+
+
+def _pick_chunks(shape, dtype, target=None):
+    """Choose the chunk shape for a dataset of `shape` and `dtype`.
+
+    Chunks hold roughly `target` bytes (default: `chunk_nbytes`).
+    Trailing dimensions are kept whole where possible and the data is
+    split along the leading dimension(s), so that reading a range of
+    rows (e.g., a subset of a `flat` object) touches as few chunks as
+    possible.
+    """
+    if len(shape) == 0 or 0 in shape:
+        # Leave scalar and empty datasets to h5py.
+        return None
+    if target is None:
+        target = chunk_nbytes
+    itemsize = np.dtype(dtype).itemsize
+    chunks = list(shape)
+    for ax in range(len(chunks)):
+        row_nbytes = itemsize * int(np.prod(chunks[ax + 1:]))
+        if row_nbytes <= target:
+            chunks[ax] = max(min(chunks[ax], target // row_nbytes), 1)
+            break
+        chunks[ax] = 1
+    return tuple(chunks)
+
+
+def _get_chunks(chunks, arr):
+    if chunks is True:
+        return _pick_chunks(arr.shape, arr.dtype)
+    return chunks
+
+
+def _create_array(buf, nm, arr, chunks, comp, plain_small=False):
+    """Create (and write) the dataset `nm` in `buf` from `arr`.
+
+    If `plain_small` is True, arrays smaller than one chunk are stored
+    contiguously and uncompressed.
+    """
+    if plain_small and arr.nbytes < chunk_nbytes:
+        # Chunking and filtering small arrays costs more time than it
+        # saves space.
+        return buf.create_dataset(name=nm, data=arr)
+    return buf.create_dataset(name=nm, data=arr,
+                              chunks=_get_chunks(chunks, arr), **comp)
+
+
+def _pickle_item(val):
+    # Binary pickles may contain NULL bytes, which HDF5 (vlen) strings
+    # do not support, so they are stored as uint8 arrays.
+    return np.frombuffer(pkl.dumps(val), dtype=np.uint8)
+
 
+# Element-wise pickling of object arrays (see also `_unpickle_array`).
+_pickle_array = np.frompyfunc(_pickle_item, 1, 1)
+# The dtype of the datasets that hold pickled object arrays.
+_vlen_uint8 = h5py.special_dtype(vlen=np.dtype('uint8'))
 
-def hdf5_write(buf, indat, chunks=True, compression='gzip'):
+
+def _packable(dat):
+    """Whether the array `dat` should be packed (see `hdf5_write`)."""
+    return (dat.__class__ is np.ndarray and dat.dtype.kind in 'biufc' and
+            0 < dat.nbytes < pack_nbytes)
+
+
+def _write_packed(buf, packed):
+    """Write the (name, array) pairs in `packed` to a single compound
+    dataset in `buf`."""
+    dtype = np.dtype([(nm, dat.dtype, dat.shape) for nm, dat in packed])
+    arr = np.zeros((), dtype=dtype)
+    for nm, dat in packed:
+        arr[nm] = dat
+    ds = buf.create_dataset(_packed_name, data=arr)
+    ds.attrs['_type'] = 'packed'
+
+
+def hdf5_write(buf, indat, chunks=True, compression='blosc:lz4'):
     if isinstance(buf, six.string_types):
         # If it is a filename open the file using `with`.
         with h5py.File(buf, 'w') as h5buf:
             h5buf.attrs['__package_name__'] = ver.__package__
             h5buf.attrs['__version__'] = ver.__version__
+            h5buf.attrs['__pkl_protocol__'] = pkl.default_protocol
             hdf5_write(h5buf, indat, chunks=chunks, compression=compression)
         return
-    buf.attrs['__pyclass__'] = pkl.dumps(indat.__class__)
+    comp = _compression_kwargs(compression)
+    # Small arrays are only left uncompressed with the default
+    # settings, not when a compression filter is requested explicitly.
+    plain_small = chunks is True and compression == 'blosc:lz4'
+    buf.attrs['__pyclass__'] = _dumps_cls(indat.__class__)
+    # Creating a dataset has a fixed cost, which dominates the time
+    # it takes to write small arrays. So, these are collected and
+    # written to a single dataset.
+    packed = []
     for nm in indat.keys():
         dat = indat[nm]
-        if isinstance(dat, bm.data):
+        if isinstance(dat, h5py.Dataset):
+            # A lazily-loaded array.
+            dat = dat[()]
+        if isinstance(dat, np.ndarray) and _packable(dat):
+            packed.append((nm, dat))
+        elif isinstance(dat, bm.data):
             dat.to_hdf5(buf.create_group(nm),
                         chunks=chunks, compression=compression)
         elif isinstance(dat, dict):
@@ -30,32 +186,30 @@ def hdf5_write(buf, indat, chunks=True, compression='gzip'):
             tmp.to_hdf5(buf.create_group(nm),
                         chunks=chunks, compression=compression)
             # This type(dat) so that we can support 
-            buf[nm].attrs['__pyclass__'] = pkl.dumps(type(dat))
+            buf[nm].attrs['__pyclass__'] = _dumps_cls(type(dat))
         else:
             if isinstance(dat, np.ndarray):
                 if dat.dtype == 'O':
-                    shp = dat.shape
-                    ds = buf.create_dataset(
-                        nm, shp,
-                        dtype=h5py.special_dtype(vlen=bytes))
+                    # Pickle every item, then create (and write) the
+                    # dataset in a single call.
+                    pickled = _pickle_array(np.asarray(dat),
+                                            out=np.empty(dat.shape, dtype='O'))
+                    ds = buf.create_dataset(nm, data=pickled,
+                                            dtype=_vlen_uint8)
                     ds.attrs['_type'] = 'NumPy Object Array'
-                    for idf, val in enumerate(dat.flat):
-                        ida = np.unravel_index(idf, shp)
-                        ds[ida] = pkl.dumps(val)
-                elif str(dat.dtype).startswith('datetime64'):
-                    ds = buf.create_dataset(
-                        name=nm, data=dat.astype('S'),
-                        chunks=chunks, compression=compression)
+                elif dat.dtype.kind in 'mM':
+                    # Store datetime64 and timedelta64 values as int64,
+                    # and their dtype (with its units) in '_type'.
+                    ds = _create_array(buf, nm, dat.view('i8'),
+                                       chunks, comp, plain_small)
                     ds.attrs['_type'] = str(dat.dtype)
                 elif dat.dtype.kind == 'U':
-                    ds = buf.create_dataset(
-                        name=nm, data=dat.astype('S'),
-                        chunks=chunks, compression=compression)
+                    ds = _create_array(buf, nm, dat.astype('S'),
+                                       chunks, comp, plain_small)
                 else:
                     try:
-                        ds = buf.create_dataset(
-                            name=nm, data=dat,
-                            chunks=chunks, compression=compression)
+                        ds = _create_array(buf, nm, dat, chunks, comp,
+                                           plain_small)
                     except TypeError:
                         ds = buf.create_dataset(
                             name=nm, data=dat)
@@ -65,14 +219,35 @@ def hdf5_write(buf, indat, chunks=True, compression='gzip'):
                 except (TypeError, ValueError):
                     # Pickle the object.
                     val = pkl.dumps(dat)
-                    ds = buf.require_dataset(
-                        nm, (), dtype='S{}'.format(len(val))
-                    )
-                    ds[()] = val
+                    ds = buf.create_dataset(
+                        nm, data=np.array(val, dtype='S{}'.format(len(val))))
                     ds.attrs['_type'] = 'pickled object'
                 else:
                     ds.attrs['_type'] = 'non-array scalar'
-            ds.attrs['__pyclass__'] = pkl.dumps(type(dat))
+            ds.attrs['__pyclass__'] = _dumps_cls(type(dat))
+    if len(packed) > 1:
+        _write_packed(buf, packed)
+    else:
+        for nm, dat in packed:
+            ds = _create_array(buf, nm, dat, chunks, comp,
+                               plain_small)
+            ds.attrs['__pyclass__'] = _dumps_cls(type(dat))
+
+
+def _unpickle_item(val):
+    if isinstance(val, np.ndarray):
+        # A pickle stored as a uint8 array.
+        val = val.tobytes()
+    # Unwritten elements of a vlen dataset are read as empty.
+    if not val:
+        return None
+    try:
+        return pkl.loads(val)
+    except:
+        return val
+
+
+_unpickle_array = np.frompyfunc(_unpickle_item, 1, 1)
 
 
 def cls_pklstr_gen(cls_pklstr):
@@ -92,100 +267,183 @@ def cls_pklstr_gen(cls_pklstr):
         yield b'c' + mod + b'\n' + cls
 
 
-def load_hdf5(buf, group=None, dat_class=None):
+# A cache of the classes found by `_resolve_cls`, keyed by their
+# pickle string.
+_resolved_cls_cache = {}
+
+
+def _resolve_cls(cls_pklstr):
+    """Return the class pickled in `cls_pklstr`, or None if it cannot
+    be found (see `cls_pklstr_gen`).
+
+    Files usually contain many groups of the same class, so the
+    result is cached.
+    """
+    try:
+        return _resolved_cls_cache[cls_pklstr]
+    except KeyError:
+        pass
+    outclass = None
+    # The try loop focuses on finding the class...
+    for pklstr in cls_pklstr_gen(cls_pklstr):
+        try:
+            outclass = pkl.loads(pklstr)
+        except ImportError:
+            pass
+        else:
+            # No error, so stop the loop.
+            break
+    _resolved_cls_cache[cls_pklstr] = outclass
+    return outclass
+
+
+def _read_array(dat):
+    """Read all of the hdf5 dataset `dat` into a new array."""
+    if dat.dtype.kind == 'O' or dat.size == 0:
+        # Leave variable-length (and empty) data to h5py.
+        return np.asarray(dat[()])
+    arr = np.empty(dat.shape, dtype=dat.dtype)
+    # Read straight into `arr`, rather than into a temporary array
+    # that is then copied.
+    dat.read_direct(arr)
+    return arr
+
+
+def _load_group(buf, dat_class=None, lazy=False):
+    """
+    Load the datasets of the hdf5 group `buf` into a new data object.
+
+    Sub-groups are not loaded (see `load_hdf5`).
+    """
+    if dat_class is None:
+        outclass = _resolve_cls(buf.attrs['__pyclass__'])
+        if outclass is None:
+            print("Warning: Class '{}' not found, defaulting to "
+                  "generic 'pycoda.data'.".format(buf.attrs['__pyclass__']))
+            outclass = bm.data
+        # Now call it
+        out = outclass()
+    else:
+        out = dat_class()
+    for nm in buf.keys():
+        dat = buf[nm]
+        if dat.__class__ is h5py.Group:
+            continue
+        type_str = dat.attrs.get('_type', None)
+        try:
+            type_str = pkl.decode(type_str)
+        except AttributeError:
+            pass
+        cls = dat.attrs.get('__pyclass__', np.ndarray)
+        if cls is not np.ndarray:
+            cls = pkl.loads(cls)
+        if type_str == 'packed':
+            packed = dat[()]
+            for fnm in packed.dtype.names:
+                out[fnm] = np.array(packed[fnm])
+        elif type_str == 'pickled object':
+            try:
+                out[nm] = pkl.loads(dat[()])
+            except KeyError:
+                out._set(nm, pkl.loads(dat[()]))
+        elif type_str == 'non-array scalar':
+            try:
+                out[nm] = pkl.decode(dat[()])
+            except KeyError:
+                out._set(nm, pkl.decode(dat[()]))
+        elif (dat.dtype == 'O' and type_str == 'NumPy Object Array'):
+            # Read the whole dataset at once, then unpickle it.
+            out[nm] = _unpickle_array(dat[...],
+                                      out=np.empty(dat.shape, dtype='O'))
+            if cls is not np.ndarray:
+                out[nm] = out[nm].view(cls)
+        elif (lazy and type_str is None and cls is np.ndarray and
+              dat.dtype.kind not in 'SO'):
+            # Leave the data in the file.
+            out[nm] = dat
+        else:
+            arr = _read_array(dat)
+            if isinstance(type_str, six.string_types) and \
+               type_str.startswith(('datetime64', 'timedelta64')):
+                if arr.dtype.kind == 'S':
+                    # Older files store datetimes as strings.
+                    arr = arr.astype(type_str)
+                else:
+                    arr = arr.view(type_str)
+            if cls is not np.ndarray:
+                arr = arr.view(cls)
+            if arr.dtype.name.startswith('bytes'):
+                arr = arr.astype('<U')
+            out[nm] = arr
+    return out
+
+
+def load_hdf5(buf, group=None, dat_class=None, lazy=False):
     """
     Load a data object from an hdf5 file.
+
+    If `lazy` is True, numeric arrays are not read into memory.
+    Instead, their entries are the `h5py.Dataset` objects, and the
+    file is kept open (as the `_file` attribute of the output). Taking
+    a subset of the data (e.g., `dat.subset[10:500]`) then reads only
+    the selected part of each array from the file. Use
+    `dat.materialize()` to read all of the data into memory.
     """
     if isinstance(buf, six.string_types):
-        with h5py.File(buf, 'r') as fl:
+        if lazy:
+            fl = h5py.File(buf, 'r', rdcc_nbytes=chunk_cache_nbytes)
+            out = load_hdf5(fl, group=group, dat_class=dat_class, lazy=True)
+            if isinstance(out, bm.data):
+                out._file = fl
+            else:
+                fl.close()
+            return out
+        with h5py.File(buf, 'r', rdcc_nbytes=chunk_cache_nbytes) as fl:
             return load_hdf5(fl, group=group, dat_class=dat_class)
     if isinstance(group, list):
         if '' in group:
-            out = load_hdf5(buf, group='')
+            out = load_hdf5(buf, group='', lazy=lazy)
             group.remove('')
         else:
             out = bm.data()
         for g in group:
-            out[g] = load_hdf5(buf, group=g)
+            out[g] = load_hdf5(buf, group=g, lazy=lazy)
         return out
     if group == '':
-        pass
+        # Only load the datasets at the top level.
+        return _load_group(buf, dat_class=dat_class, lazy=lazy)
     elif group is not None:
-        buf = buf[group]
-    if dat_class is None:
-        outclass = None
-        # The try loop focuses on finding the class...
-        c_tmp = buf.attrs['__pyclass__']
-        for cls_pklstr in cls_pklstr_gen(c_tmp):
-            try:
-                outclass = pkl.loads(cls_pklstr)
-            except ImportError:
-                pass
-            else:
-                # No error, so stop the loop.
-                break
-        if outclass is None:
-            print("Warning: Class '{}' not found, defaulting to "
-                  "generic 'pycoda.data'.".format(buf.attrs['__pyclass__']))
-            outclass = bm.data
-        # Now call it
-        out = outclass()
-    else:
-        out = dat_class()
-    if hasattr(buf, 'keys'):
-        for nm in buf.keys():
-            dat = buf[nm]
-            type_str = dat.attrs.get('_type', None)
-            try:
-                type_str = pkl.decode(type_str)
-            except AttributeError:
-                pass
-            if dat.__class__ is h5py.Group:
-                if group != '':
-                    out[nm] = load_hdf5(dat)
-            else:
-                cls = dat.attrs.get('__pyclass__', np.ndarray)
-                if cls is not np.ndarray:
-                    cls = pkl.loads(cls)
-                if type_str == 'pickled object':
-                    try:
-                        out[nm] = pkl.loads(dat[()])
-                    except KeyError:
-                        out._set(nm, pkl.loads(dat[()]))
-                elif type_str == 'non-array scalar':
-                    try:
-                        out[nm] = pkl.decode(dat[()])
-                    except KeyError:
-                        out._set(nm, pkl.decode(dat[()]))
-                elif (dat.dtype == 'O' and type_str == 'NumPy Object Array'):
-                    shp = dat.shape
-                    out[nm] = np.empty(shp, dtype='O')
-                    for idf in range(dat.size):
-                        ida = np.unravel_index(idf, shp)
-                        if dat[ida] == '':
-                            out[nm][ida] = None
-                        else:
-                            tmp = dat[ida]
-                            try:
-                                out[nm][ida] = pkl.loads(tmp)
-                            except:
-                                out[nm][ida] = tmp
-                    if cls is not np.ndarray:
-                        out[nm] = out[nm].view(cls)
-                else:
-                    out[nm] = np.array(dat)
-                    if isinstance(type_str, six.string_types) and \
-                       type_str.startswith('datetime64'):
-                        out[nm] = out[nm].astype(type_str)
-                    if cls is not np.ndarray:
-                        out[nm] = out[nm].view(cls)
-                    if out[nm].dtype.name.startswith('bytes'):
-                        out[nm] = out[nm].astype('<U')
-    else:
-        out = np.array(buf)
+        try:
+            buf = buf[group]
+        except KeyError:
+            # The array may be packed (see `hdf5_write`).
+            parent, _, nm = group.rpartition('/')
+            parent = buf[parent] if parent else buf
+            packed = parent.get(_packed_name)
+            if packed is None or nm not in packed.dtype.names:
+                raise
+            return np.array(packed[()][nm])
+    if not isinstance(buf, h5py.Group):
+        out = _read_array(buf)
+        type_str = pkl.decode(buf.attrs.get('_type', ''))
+        if type_str.startswith(('datetime64', 'timedelta64')) and \
+           out.dtype.kind != 'S':
+            out = out.view(type_str)
         cls = buf.attrs.get('__pyclass__', np.ndarray)
         if cls is not np.ndarray:
             out = out.view(pkl.loads(cls))
+        return out
+    out = _load_group(buf, dat_class=dat_class, lazy=lazy)
+    # Walk the sub-groups iteratively (parents are visited before
+    # their children), rather than recursing into each of them.
+    groups = {'': out}
+
+    def load_subgroup(name, obj):
+        if obj.__class__ is h5py.Group:
+            parent, _, nm = name.rpartition('/')
+            groups[name] = _load_group(obj, lazy=lazy)
+            groups[parent][nm] = groups[name]
+    buf.visititems(load_subgroup)
     return out
 
 
@@ -195,6 +453,7 @@ def _debug_write(fname, dat):
     h5buf = h5py.File(fname, 'w')
     h5buf.attrs['__package_name__'] = ver.__package__
     h5buf.attrs['__version__'] = ver.__version__
+    h5buf.attrs['__pkl_protocol__'] = pkl.default_protocol
     hdf5_write(h5buf, dat)
     return h5buf
 
@@ -0,0 +1,135 @@
+"""
+Read and write data objects to/from zarr stores.
+
+This requires the (optional) `zarr` (<3) and `numcodecs` packages. Unlike
+hdf5 files, the chunks of a zarr store are compressed (and written)
+independently, so this format suits large data and parallel I/O.
+"""
+import base64
+import h5py
+import numpy as np
+import six
+from . import _version as ver
+from . import pkl
+from .io import _pick_chunks
+try:
+    # PY 3
+    from . import base as bm
+except ImportError:
+    # PY 2
+    import base as bm
+try:
+    import zarr
+    import numcodecs
+except ImportError:
+    zarr = None
+    numcodecs = None
+
+if numcodecs is not None:
+    # The compressor used by `zarr_write` (Zstandard with
+    # bit-shuffling).
+    default_compressor = numcodecs.Blosc(cname='zstd', clevel=3,
+                                         shuffle=numcodecs.Blosc.BITSHUFFLE)
+else:
+    default_compressor = None
+
+
+def _check_zarr():
+    if zarr is None:
+        raise ImportError("Reading and writing zarr stores requires "
+                          "the 'zarr' and 'numcodecs' packages.")
+    if int(zarr.__version__.split('.')[0]) >= 3:
+        # The v3 API (create_array, compressors=, ...) is different.
+        raise ImportError("pyDictH5 requires zarr<3 (zarr {} is "
+                          "installed).".format(zarr.__version__))
+
+
+def _encode(obj):
+    # Zarr attributes are stored as JSON, so pickles are base64 encoded.
+    return base64.b64encode(pkl.dumps(obj)).decode('ascii')
+
+
+def _decode(val):
+    return pkl.loads(base64.b64decode(val))
+
+
+def zarr_write(buf, indat, chunks=True, compressor=True):
+    """
+    Write the data object `indat` to the zarr store (or group) `buf`.
+
+    With `chunks=True` the chunk shape is chosen as for hdf5 files
+    (see `io._pick_chunks`). `compressor=True` uses
+    `default_compressor`; specify a `numcodecs` codec to use a
+    different one, or None to disable compression.
+    """
+    _check_zarr()
+    if isinstance(buf, six.string_types):
+        grp = zarr.open_group(buf, mode='w')
+        grp.attrs['__package_name__'] = ver.__package__
+        grp.attrs['__version__'] = ver.__version__
+        zarr_write(grp, indat, chunks=chunks, compressor=compressor)
+        return
+    if compressor is True:
+        compressor = default_compressor
+    buf.attrs['__pyclass__'] = _encode(indat.__class__)
+    for nm in indat.keys():
+        dat = indat[nm]
+        if isinstance(dat, h5py.Dataset):
+            # A lazily-loaded array.
+            dat = dat[()]
+        if isinstance(dat, dict):
+            if not isinstance(dat, bm.data):
+                dat = bm.data(dat)
+            grp = buf.create_group(nm)
+            zarr_write(grp, dat, chunks=chunks, compressor=compressor)
+            grp.attrs['__pyclass__'] = _encode(type(indat[nm]))
+            continue
+        if isinstance(dat, np.ndarray) and dat.dtype.kind != 'O':
+            if chunks is True or dat.size == 0:
+                # Zarr cannot use the (zero-length) shape of an empty
+                # array as its chunks, so those are always auto-chunked.
+                chnk = _pick_chunks(dat.shape, dat.dtype) or True
+            else:
+                chnk = chunks
+            ds = buf.create_dataset(nm, data=dat, chunks=chnk,
+                                    compressor=compressor)
+        else:
+            # Object arrays, and other objects, are pickled.
+            shape = dat.shape if isinstance(dat, np.ndarray) else ()
+            ds = buf.create_dataset(nm, shape=shape, dtype=object,
+                                    object_codec=numcodecs.Pickle())
+            if isinstance(dat, np.ndarray):
+                ds[...] = dat
+            else:
+                ds[()] = dat
+                ds.attrs['_type'] = 'non-array scalar'
+        ds.attrs['__pyclass__'] = _encode(type(dat))
+
+
+def load_zarr(buf, dat_class=None):
+    """
+    Load a data object from a zarr store (or group).
+    """
+    _check_zarr()
+    if isinstance(buf, six.string_types):
+        buf = zarr.open_group(buf, mode='r')
+    if dat_class is None:
+        try:
+            dat_class = _decode(buf.attrs['__pyclass__'])
+        except (ImportError, AttributeError):
+            print("Warning: Class of '{}' not found, defaulting to "
+                  "generic 'pycoda.data'.".format(buf.name))
+            dat_class = bm.data
+    out = dat_class()
+    for nm, dat in buf.arrays():
+        if dat.attrs.get('_type', None) == 'non-array scalar':
+            out[nm] = dat[()]
+            continue
+        arr = dat[...]
+        cls = _decode(dat.attrs['__pyclass__'])
+        if cls is not np.ndarray:
+            arr = arr.view(cls)
+        out[nm] = arr
+    for nm, grp in buf.groups():
+        out[nm] = load_zarr(grp)
+    return out
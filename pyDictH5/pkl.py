@@ -21,8 +21,15 @@ def decode(val):
     return val
 
 
-def dumps(data):
-    return pkl.dumps(data, protocol=0)
+# The pickle protocol used by `dumps`. Set this to 2 to write files
+# that can be read with Python 2.
+default_protocol = pkl.HIGHEST_PROTOCOL
+
+
+def dumps(data, protocol=None):
+    if protocol is None:
+        protocol = default_protocol
+    return pkl.dumps(data, protocol=protocol)
 
 
 def loads(data):
@@ -1,4 +1,4 @@
-from base import data
+from .base import data
 try:
     import pandas as pd
 except ImportError:
@@ -19,6 +19,42 @@ class tabular(data):
     only.
     """
 
+    def pack(self, ):
+        """
+        Store the 1-D float64 columns in a single column-major
+        (Fortran-ordered) array.
+
+        After packing, each of these columns is a view into that
+        array, and `to_dataframe` uses it as a single block (without
+        copying each column). Columns that are replaced after packing
+        are handled as unpacked columns.
+        """
+        names = [nm for nm, val in self.items()
+                 if isinstance(val, np.ndarray) and val.ndim == 1 and
+                 val.dtype == np.float64]
+        if len(names) == 0:
+            self._packed = None
+            return
+        buf = np.empty((len(self[names[0]]), len(names)), order='F')
+        views = []
+        for idx, nm in enumerate(names):
+            buf[:, idx] = self[nm]
+            views.append(buf[:, idx])
+            dict.__setitem__(self, nm, views[-1])
+        self._packed = (buf, names, views)
+
+    def _get_packed(self, ):
+        # Return the packed buffer and its column names, if the packed
+        # columns have not been replaced since `pack` was called.
+        packed = self.__dict__.get('_packed')
+        if packed is None:
+            return None, []
+        buf, names, views = packed
+        for nm, view in zip(names, views):
+            if self.get(nm) is not view:
+                return None, []
+        return buf, names
+
     if pd is None:
 
         def to_dataframe(self, ):
@@ -30,14 +66,23 @@ class tabular(data):
     else:
 
         def to_dataframe(self,):
-            siteout = None
-            for nm, val in self.iteritems():
-                if val.ndim == 1:
-                    if siteout is None:
-                        siteout = pd.DataFrame(val, columns=[nm])
-                    else:
-                        siteout.loc[:, nm] = pd.Series(val)
-                else:
+            # Build the frame from all of the 1-D columns at once, rather
+            # than inserting (and copying) them one at a time.
+            buf, packed = self._get_packed()
+            siteout = pd.DataFrame(dict((nm, val)
+                                        for nm, val in self.items()
+                                        if val.ndim == 1 and
+                                        nm not in packed))
+            if buf is not None:
+                # The packed columns are a single column-major block.
+                siteout = pd.concat([pd.DataFrame(buf, columns=packed,
+                                                  copy=False),
+                                     siteout], axis=1)
+                # Put the columns back in the order of the keys.
+                siteout = siteout[[nm for nm, val in self.items()
+                                   if val.ndim == 1]]
+            for nm, val in self.items():
+                if val.ndim != 1:
                     siteout[nm] = pd.DataFrame(val)
             return siteout
 
@@ -22,4 +22,5 @@ setup(
         'Natural Language :: English',
     ],
     install_requires=['h5py', 'numpy'],
+    extras_require={'zarr': ['zarr<3', 'numcodecs']},
 )